@@ -0,0 +1,22 @@
+import os
+import pandas as pd
+
+def read_corpus(csv_path, usecols, dtype, write_cache=False):
+    """
+    Read a corpus CSV through the Parquet copy next to it.
+    The CSV stays the source of truth: the Parquet copy is only used when it
+    is at least as new as the CSV and can be read with the requested columns.
+    dtype applies to both paths, so callers get the same columns either way.
+    With write_cache, the copy is rewritten whenever the CSV had to be parsed.
+    """
+    parquet_path = os.path.splitext(csv_path)[0] + '.parquet'
+    if os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= os.path.getmtime(csv_path):
+        try:
+            return pd.read_parquet(parquet_path, columns=usecols).astype(dtype)
+        except (KeyError, ValueError, OSError):
+            # Stale schema or a partial/corrupt file: fall back to the CSV
+            pass
+    df = pd.read_csv(csv_path, usecols=usecols, dtype=dtype)
+    if write_cache:
+        df.to_parquet(parquet_path, engine='pyarrow', compression='zstd')
+    return df
@@ -1,10 +1,13 @@
 import streamlit as st
-import json
-import base64
+import orjson
 import pandas as pd
 import os
-from io import BytesIO
+import re
+import numpy as np
+import ahocorasick
+from collections import defaultdict
 from PIL import Image
+from corpus_io import read_corpus
 
 # Page configuration
 st.set_page_config(
@@ -16,54 +19,122 @@ st.set_page_config(
 # Load data
 @st.cache_data
 def load_jsonl_data(jsonl_path):
-    """Load data from JSONL file"""
-    data = []
-    with open(jsonl_path, 'r') as f:
-        for line in f:
-            if line.strip():
-                data.append(json.loads(line))
-    return data
+    """Load figure metadata (no images) from JSONL file"""
+    with open(jsonl_path, 'rb') as f:
+        return [orjson.loads(line) for line in f if line.strip()]
 
 @st.cache_data
 def load_journal_mapping(csv_path):
-    """Load journal to PII mapping from CSV"""
-    df = pd.read_csv(csv_path)
+    """Load journal to PII mapping from CSV, or its Parquet copy when up to date"""
+    df = read_corpus(csv_path, usecols=['journal', 'pii'], dtype={'journal': 'string', 'pii': 'string'})
     # Get unique journal-PII pairs
     journal_pii = df[['journal', 'pii']].drop_duplicates()
     return journal_pii
 
-def decode_base64_image(image_base64):
-    """Decode base64 image string to PIL Image"""
-    if not image_base64:
+@st.cache_resource
+def build_indexes(jsonl_path, csv_path):
+    """Join journals onto the entries once and index them by figure, paper and journal"""
+    entries = load_jsonl_data(jsonl_path)
+    journal_pii_df = load_journal_mapping(csv_path)
+    pii_to_journal = dict(zip(journal_pii_df['pii'], journal_pii_df['journal']))
+    
+    by_pii_fig = {}
+    pii_to_figs = defaultdict(list)
+    for entry in entries:
+        entry['journal'] = pii_to_journal.get(entry['pii'], 'Unknown')
+        # Lowercase once here so every search query reuses it
+        entry['_lc_caption'] = (entry.get('caption') or '').lower()
+        entry['_lc_descs'] = [desc.lower() for desc in entry.get('descriptions') or []]
+        by_pii_fig.setdefault((entry['pii'], entry['figure_id']), entry)
+        pii_to_figs[entry['pii']].append(entry['figure_id'])
+    pii_to_figs = {pii: sorted(figure_ids) for pii, figure_ids in pii_to_figs.items()}
+    
+    # groupby drops missing journals, like the journal selector does
+    journal_to_piis = {
+        journal: sorted(piis.unique())
+        for journal, piis in journal_pii_df.groupby('journal')['pii']
+    }
+    journals_sorted = sorted([j for j in journal_pii_df['journal'].unique() if pd.notna(j)])
+    return entries, by_pii_fig, pii_to_figs, journal_to_piis, journals_sorted
+
+token_pattern = re.compile(r"[a-z0-9]+")
+
+@st.cache_resource
+def build_search_index(jsonl_path, csv_path):
+    """Build a token -> entry ids inverted index over captions and descriptions"""
+    entries = build_indexes(jsonl_path, csv_path)[0]
+    index = defaultdict(set)
+    for i, entry in enumerate(entries):
+        for text in [entry['_lc_caption'], *entry['_lc_descs']]:
+            for token in token_pattern.findall(text):
+                index[token].add(i)
+    # The vocabulary joined into one string, so substring lookups are a single C-level scan
+    vocab = list(index)
+    vocab_blob = '\n'.join(vocab)
+    vocab_starts = np.cumsum([0] + [len(word) + 1 for word in vocab[:-1]])
+    return dict(index), vocab, vocab_blob, vocab_starts
+
+def find_candidates(search_index, search_query_lower):
+    """Return the set of ids of entries that may contain the query, or None to scan all"""
+    index, vocab, vocab_blob, vocab_starts = search_index
+    tokens = token_pattern.findall(search_query_lower)
+    candidates = None
+    for pos, token in enumerate(tokens):
+        if 0 < pos < len(tokens) - 1:
+            # Inner tokens are delimited on both sides, so they must match whole
+            postings = index.get(token, set())
+        elif len(token) < 3:
+            # Short fragments occur in most words; a plain scan is cheaper
+            continue
+        else:
+            # Edge tokens may be cut off by the query, so match them as substrings
+            # of the vocabulary words and map the hit offsets back to words
+            hits = [m.start() for m in re.finditer(re.escape(token), vocab_blob)]
+            word_ids = np.unique(np.searchsorted(vocab_starts, hits, side='right') - 1)
+            postings = set().union(*(index[vocab[i]] for i in word_ids))
+        candidates = postings if candidates is None else candidates & postings
+        if not candidates:
+            break
+    return candidates
+
+@st.cache_data
+def journal_histogram(jsonl_path, csv_path, _data):
+    """Count figures per journal, most figures first (cached per data source)"""
+    journal_counts = pd.Series([entry.get('journal', 'Unknown') for entry in _data]).value_counts()
+    return journal_counts.rename_axis('Journal').reset_index(name='Number of Figures')
+
+@st.cache_data(max_entries=64, ttl=600)
+def load_image(image_path):
+    """Load a figure image from the image store, cached by its path string only"""
+    if not image_path:
+        return None
+    # Stored paths are relative to the directory prepare_corpus.py ran in
+    image_path = os.path.join(script_dir, image_path)
+    if not os.path.exists(image_path):
         return None
     try:
-        image_bytes = base64.b64decode(image_base64)
-        image = Image.open(BytesIO(image_bytes))
-        return image
+        # Decode fully and close the file so cached images hold no open handles
+        with open(image_path, 'rb') as f:
+            return Image.open(f).copy()
     except Exception as e:
-        st.error(f"Error decoding image: {e}")
+        st.error(f"Error loading image: {e}")
         return None
 
 # Load data - handle paths relative to script location
 script_dir = os.path.dirname(os.path.abspath(__file__))
-jsonl_path = os.path.join(script_dir, 'pii_fig_ref_para_dict.jsonl')
+jsonl_path = os.path.join(script_dir, 'pii_fig_meta.jsonl')
 csv_path = os.path.join(script_dir, '../data/corpus_acta_mini_tagged.csv')
 csv_path = os.path.normpath(csv_path)
 
 try:
-    data = load_jsonl_data(jsonl_path)
+    # Entries come back with their journal already joined on
+    data, by_pii_fig, pii_to_figs, journal_to_piis, journals = build_indexes(jsonl_path, csv_path)
+    search_index = build_search_index(jsonl_path, csv_path)
     journal_pii_df = load_journal_mapping(csv_path)
 except FileNotFoundError as e:
     st.error(f"File not found: {e}")
     st.stop()
 
-# Create a mapping from PII to journal
-pii_to_journal = dict(zip(journal_pii_df['pii'], journal_pii_df['journal']))
-
-# Add journal to each data entry
-for entry in data:
-    entry['journal'] = pii_to_journal.get(entry['pii'], 'Unknown')
-
 # Title
 st.title("🔬 MARVL Figure Viewer")
 st.markdown("Visualize figures from scientific papers with captions and descriptions")
@@ -87,39 +158,64 @@ view_mode = st.radio(
 st.markdown("---")
 
 # Search functionality
-def search_figures(data, search_query, search_in_caption=True, search_in_descriptions=True):
-    """Search figures by keyword in captions and/or descriptions"""
-    if not search_query:
+def find_first_keyword(matcher, text_lower):
+    """Return (start index, keyword) of the first keyword hit in text, or None"""
+    if isinstance(matcher, str):
+        idx = text_lower.find(matcher)
+        return (idx, matcher) if idx != -1 else None
+    for end, keyword in matcher.iter(text_lower):
+        return end - len(keyword) + 1, keyword
+    return None
+
+def search_figures(data, search_index, search_query, search_in_caption=True, search_in_descriptions=True):
+    """Search figures by comma-separated keywords in captions and/or descriptions"""
+    keywords = [k.strip() for k in search_query.lower().split(',')]
+    keywords = [k for k in keywords if k]
+    if not keywords:
         return []
     
-    search_query_lower = search_query.lower()
+    if len(keywords) == 1:
+        # A single literal needs no automaton; str.find is faster
+        matcher = keywords[0]
+    else:
+        # One automaton matches every keyword in a single pass over each text
+        matcher = ahocorasick.Automaton()
+        for keyword in keywords:
+            matcher.add_word(keyword, keyword)
+        matcher.make_automaton()
+    
+    # Narrow single-keyword queries with the index; with several keywords the
+    # per-keyword lookups cost more than one automaton pass over every entry
+    candidates = find_candidates(search_index, keywords[0]) if len(keywords) == 1 else None
+    candidates = range(len(data)) if candidates is None else sorted(candidates)
     results = []
     
-    for entry in data:
+    for entry_id in candidates:
+        entry = data[entry_id]
         matches = False
         match_text = ""
         
         # Search in caption
         if search_in_caption and entry.get('caption'):
-            caption_lower = entry['caption'].lower()
-            if search_query_lower in caption_lower:
+            hit = find_first_keyword(matcher, entry['_lc_caption'])
+            if hit:
                 matches = True
                 # Find context around the match
-                idx = caption_lower.find(search_query_lower)
+                idx, keyword = hit
                 start = max(0, idx - 50)
-                end = min(len(entry['caption']), idx + len(search_query) + 50)
+                end = min(len(entry['caption']), idx + len(keyword) + 50)
                 match_text = f"Caption: ...{entry['caption'][start:end]}..."
         
         # Search in descriptions
         if search_in_descriptions and entry.get('descriptions'):
             for i, desc in enumerate(entry['descriptions']):
-                desc_lower = desc.lower()
-                if search_query_lower in desc_lower:
+                hit = find_first_keyword(matcher, entry['_lc_descs'][i])
+                if hit:
                     matches = True
                     # Find context around the match
-                    idx = desc_lower.find(search_query_lower)
+                    idx, keyword = hit
                     start = max(0, idx - 50)
-                    end = min(len(desc), idx + len(search_query) + 50)
+                    end = min(len(desc), idx + len(keyword) + 50)
                     match_text = f"Description {i+1}: ...{desc[start:end]}..."
                     break
         
@@ -157,7 +253,7 @@ if view_mode == "🔍 Search":
     # Perform search
     if search_query or search_button:
         if search_query:
-            search_results = search_figures(data, search_query, search_in_caption, search_in_descriptions)
+            search_results = search_figures(data, search_index, search_query, search_in_caption, search_in_descriptions)
             
             if search_results:
                 st.success(f"Found {len(search_results)} matching figure(s)")
@@ -171,10 +267,9 @@ if view_mode == "🔍 Search":
                         col_img, col_info = st.columns([1, 2])
                         
                         with col_img:
-                            if entry['image']:
-                                image = decode_base64_image(entry['image'])
-                                if image:
-                                    st.image(image, caption=entry['figure_id'])
+                            image = load_image(entry.get('image_path'))
+                            if image:
+                                st.image(image, caption=entry['figure_id'])
                         
                         with col_info:
                             st.markdown(f"**Figure ID:** {entry['figure_id']}")
@@ -219,8 +314,6 @@ elif view_mode == "📋 Browse":
     # Sidebar filters
     st.sidebar.header("Filters")
     
-    # Get unique journals
-    journals = sorted([j for j in journal_pii_df['journal'].unique() if pd.notna(j)])
     selected_journal = st.sidebar.selectbox(
         "Select Journal",
         options=journals,
@@ -229,7 +322,7 @@ elif view_mode == "📋 Browse":
     
     # Filter PIIs by selected journal
     if selected_journal:
-        available_piis = sorted(journal_pii_df[journal_pii_df['journal'] == selected_journal]['pii'].unique())
+        available_piis = journal_to_piis.get(selected_journal, [])
         selected_pii = st.sidebar.selectbox(
             "Select Paper (PII)",
             options=available_piis,
@@ -240,7 +333,7 @@ elif view_mode == "📋 Browse":
     
     # Filter figures by selected PII
     if selected_pii:
-        available_figures = sorted([d['figure_id'] for d in data if d['pii'] == selected_pii])
+        available_figures = pii_to_figs.get(selected_pii, [])
         selected_figure = st.sidebar.selectbox(
             "Select Figure",
             options=available_figures,
@@ -263,7 +356,7 @@ elif view_mode == "📋 Browse":
     # Display selected data
     if selected_figure:
         # Find the selected entry
-        selected_entry = next((d for d in data if d['pii'] == selected_pii and d['figure_id'] == selected_figure), None)
+        selected_entry = by_pii_fig.get((selected_pii, selected_figure))
         
         if selected_entry:
             # Display metadata
@@ -278,14 +371,11 @@ elif view_mode == "📋 Browse":
             st.markdown("---")
             
             # Display image with caption
-            if selected_entry['image']:
-                image = decode_base64_image(selected_entry['image'])
-                if image:
-                    # Display image centered
-                    st.subheader(f"Figure: {selected_entry['figure_id']}")
-                    st.image(image, caption=selected_entry['caption'] if selected_entry['caption'] else selected_entry['figure_id'])
-                else:
-                    st.warning("Could not decode image")
+            image = load_image(selected_entry.get('image_path'))
+            if image:
+                # Display image centered
+                st.subheader(f"Figure: {selected_entry['figure_id']}")
+                st.image(image, caption=selected_entry['caption'] if selected_entry['caption'] else selected_entry['figure_id'])
             else:
                 st.warning("No image available for this figure")
             
@@ -339,12 +429,6 @@ elif view_mode == "📋 Browse":
         # Show journal breakdown
         if journals:
             st.subheader("Figures by Journal")
-            journal_counts = {}
-            for entry in data:
-                journal = entry.get('journal', 'Unknown')
-                journal_counts[journal] = journal_counts.get(journal, 0) + 1
-            
-            journal_df = pd.DataFrame(list(journal_counts.items()), columns=['Journal', 'Number of Figures'])
-            journal_df = journal_df.sort_values('Number of Figures', ascending=False)
+            journal_df = journal_histogram(jsonl_path, csv_path, data)
             st.dataframe(journal_df, use_container_width=True)
 
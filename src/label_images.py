@@ -1,31 +1,99 @@
-import pandas as pd
-from joblib import Parallel, delayed
+import os
 import numpy as np
-
-import re
+import pyarrow as pa
+import pyarrow.compute as pc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+import ahocorasick
+from corpus_io import read_corpus
 
 def compile_tag_patterns(tag_list):
-    patterns = []
+    """
+    Build a single Aho-Corasick automaton over every (lowercased) synonym.
+    Each key carries its (label, tag_name) so one pass over a caption
+    reports every tag group that occurs in it.
+    """
+    automaton = ahocorasick.Automaton()
     for label, t in enumerate(tag_list):
-        if isinstance(t, list):
-            regex = "|".join(re.escape(x.lower()) for x in t)
-            patterns.append((label, t[0], re.compile(regex)))
-        else:
-            patterns.append((label, t, re.compile(re.escape(t.lower()))))
-    return patterns
-
-def tag_chunk(df_chunk, patterns):
-    captions = df_chunk['caption'].str.lower()
-
-    df_chunk['tag'] = None
-    df_chunk['label'] = None
+        synonyms = t if isinstance(t, list) else [t]
+        tag_name = synonyms[0]
+        for x in synonyms:
+            key = x.lower()
+            # A synonym shared by several groups belongs to the first one
+            if key not in automaton:
+                automaton.add_word(key, (label, tag_name))
+    automaton.make_automaton()
+    return automaton
+
+def tag_chunk(captions, start, patterns):
+    """
+    Tag one slice of lowercased captions starting at row `start`.
+    Returns the row positions, tags and labels of the captions that matched.
+    """
+    indices = []
+    tags = []
+    labels = []
+
+    for i, caption in enumerate(captions):
+        # Earlier groups in tag_list take precedence, so keep the lowest label
+        hit = min((payload for _, payload in patterns.iter(caption)), default=None)
+        if hit is not None:
+            indices.append(start + i)
+            labels.append(hit[0])
+            tags.append(hit[1])
+
+    return (
+        np.array(indices, dtype=np.int64),
+        np.array(tags, dtype=object),
+        np.array(labels, dtype=np.int64),
+    )
 
-    for label, tag_name, pattern in patterns:
-        mask = captions.str.contains(pattern, regex=True, na=False)
-        df_chunk.loc[mask & df_chunk['tag'].isna(), 'tag'] = tag_name
-        df_chunk.loc[mask & df_chunk['label'].isna(), 'label'] = label
 
-    return df_chunk.dropna(subset=['tag'])
+def share_captions(captions):
+    """
+    Lowercase all captions in one Arrow compute pass and pack them into
+    shared memory as one UTF-8 byte block plus a block of row offsets,
+    so workers can read any row range without pickling it.
+    Missing captions are stored as empty strings.
+    """
+    lowered = pa.array(captions, type=pa.large_string(), from_pandas=True)
+    lowered = pc.fill_null(pc.utf8_lower(lowered), '')
+
+    # Arrow already keeps strings as int64 offsets into one UTF-8 buffer
+    _, offsets_buf, data_buf = lowered.buffers()
+    offsets = np.frombuffer(offsets_buf, dtype=np.int64)[lowered.offset:lowered.offset + len(lowered) + 1]
+    data = np.frombuffer(data_buf, dtype=np.uint8)[offsets[0]:offsets[-1]] if data_buf is not None else b''
+    offsets = offsets - offsets[0]
+
+    # Zero-sized blocks are not allowed
+    data_shm = SharedMemory(create=True, size=max(1, int(offsets[-1])))
+    data_shm.buf[:offsets[-1]] = data
+    offsets_shm = SharedMemory(create=True, size=offsets.nbytes)
+    np.ndarray(offsets.shape, dtype=np.int64, buffer=offsets_shm.buf)[:] = offsets
+    return data_shm, offsets_shm
+
+
+# Per-worker state set up once by init_tag_worker
+_worker_state = {}
+
+def init_tag_worker(data_name, offsets_name, n_rows, patterns):
+    """Attach to the shared caption blocks once per worker process."""
+    data_shm = SharedMemory(name=data_name)
+    offsets_shm = SharedMemory(name=offsets_name)
+    _worker_state['data_shm'] = data_shm
+    _worker_state['offsets_shm'] = offsets_shm
+    _worker_state['offsets'] = np.ndarray((n_rows + 1,), dtype=np.int64, buffer=offsets_shm.buf)
+    _worker_state['patterns'] = patterns
+
+def tag_range(start, end):
+    """Tag rows [start, end) of the shared, already lowercased captions."""
+    data = _worker_state['data_shm'].buf
+    offsets = _worker_state['offsets']
+    captions = [
+        bytes(data[offsets[i]:offsets[i + 1]]).decode('utf-8')
+        for i in range(start, end)
+    ]
+    return tag_chunk(captions, start, _worker_state['patterns'])
 
 
 def caption_labeller_parallel(DF, tag_list, n_jobs=-1, chunk_size=100_000):
@@ -34,14 +102,32 @@ def caption_labeller_parallel(DF, tag_list, n_jobs=-1, chunk_size=100_000):
 
     patterns = compile_tag_patterns(tag_list)
 
-    chunks = np.array_split(DF, len(DF) // chunk_size + 1)
-
-    processed = Parallel(n_jobs=n_jobs, backend="loky")(
-        delayed(tag_chunk)(chunk.copy(), patterns)
-        for chunk in chunks
-    )
-
-    DF_out = pd.concat(processed, ignore_index=True)
+    # Same convention as joblib: -1 means all cores, -2 all but one, ...
+    n_workers = n_jobs if n_jobs > 0 else max(1, (os.cpu_count() or 1) + 1 + n_jobs)
+
+    n_chunks = len(DF) // chunk_size + 1
+    bounds = np.linspace(0, len(DF), n_chunks + 1, dtype=np.int64)
+
+    # Workers read caption ranges from shared memory; only row bounds are sent per task
+    data_shm, offsets_shm = share_captions(DF['caption'].to_numpy(dtype=object))
+    try:
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            initializer=init_tag_worker,
+            initargs=(data_shm.name, offsets_shm.name, len(DF), patterns),
+        ) as executor:
+            processed = list(executor.map(tag_range, bounds[:-1].tolist(), bounds[1:].tolist()))
+    finally:
+        for shm in (data_shm, offsets_shm):
+            shm.close()
+            shm.unlink()
+
+    indices, tags, labels = (np.concatenate(parts) for parts in zip(*processed))
+
+    DF_out = DF.iloc[indices].reset_index(drop=True)
+    # Keep the tagged CSV schema stable: label comes before tag
+    DF_out['label'] = labels
+    DF_out['tag'] = tags
 
     # ---------- size dict ----------
     size_dict = (
@@ -61,6 +147,7 @@ def caption_labeller_parallel(DF, tag_list, n_jobs=-1, chunk_size=100_000):
     print("Labelling complete.")
     return DF_out, sorted_dict
 
+
     
 
 tag_list = [
@@ -164,20 +251,26 @@ tag_list = [
     ['image processing']
 ]
 
-take_tags = ['TEM','SEM','EDS','FIB','AFM','microstructure','EBSD','Optical microscopy','STM','PFM','MFM']
-
-df = pd.read_csv('../data/corpus_acta_mini.csv')
-
-newdf, res = caption_labeller_parallel(df, tag_list, n_jobs=4)
-new_mask = newdf.tag.isin(take_tags)
-newdf2 = newdf[new_mask]
-
-print(newdf2.shape)
-print('Total images: ', df.shape[0])
-print('Total images with tags: ', newdf2.shape[0])
-print('Tags summary: ', newdf2.tag.value_counts())
-print('Tagged data saved to ../data/corpus_acta_mini_tagged.csv')
-newdf2.to_csv('../data/corpus_acta_mini_tagged.csv', index=False)
-
+if __name__ == '__main__':
+    take_tags = ['TEM','SEM','EDS','FIB','AFM','microstructure','EBSD','Optical microscopy','STM','PFM','MFM']
 
+    # Only the caption is labelled; the existing label column is recomputed, so skip it
+    df = read_corpus(
+        '../data/corpus_acta_mini.csv',
+        usecols=['journal', 'pii', 'url', 'name', 'caption'],
+        dtype={'caption': 'string'},
+        write_cache=True
+    )
 
+    newdf, res = caption_labeller_parallel(df, tag_list, n_jobs=4)
+    new_mask = newdf.tag.isin(take_tags)
+    newdf2 = newdf[new_mask]
+
+    print(newdf2.shape)
+    print('Total images: ', df.shape[0])
+    print('Total images with tags: ', newdf2.shape[0])
+    print('Tags summary: ', newdf2.tag.value_counts())
+    print('Tagged data saved to ../data/corpus_acta_mini_tagged.csv (+ .parquet)')
+    newdf2.to_csv('../data/corpus_acta_mini_tagged.csv', index=False)
+    # Written after the CSV so readers see a Parquet copy that is up to date
+    newdf2.to_parquet('../data/corpus_acta_mini_tagged.parquet', engine='pyarrow', compression='zstd')
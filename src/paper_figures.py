@@ -0,0 +1,142 @@
+from lxml import etree
+import re
+import os
+import shutil
+from collections import defaultdict
+
+NS = {'ce': 'http://www.elsevier.com/xml/common/dtd'}
+FLOAT_ANCHOR_TAG = f"{{{NS['ce']}}}float-anchor"
+CROSS_REF_TAG = f"{{{NS['ce']}}}cross-ref"
+
+figure_xpath = etree.XPath('//ce:figure', namespaces=NS)
+para_xpath = etree.XPath('//ce:para', namespaces=NS)
+cref_xpath = etree.XPath('.//ce:cross-ref/@refid | .//ce:float-anchor/@refid', namespaces=NS)
+
+def clean_math(math_tag):
+    """
+    Convert <math> tag into clean text like 'T=0 K'
+    """
+    # Get main text (ignoring nested <ce:hsp>)
+    main_text = "".join(math_tag.xpath('text()')).strip()
+    # Get unit text from <rm> if exists
+    unit_text = "".join(["".join(t.strip() for t in rm.itertext()) for rm in math_tag.iter("rm")])
+    if unit_text:
+        return f"{main_text} {unit_text}"
+    return main_text
+
+def iter_readable_text(node):
+    """
+    Yield the text pieces of a node in document order, in a single pass:
+    <math> becomes its cleaned text, <ce:float-anchor> is dropped and
+    <ce:cross-ref> collapses to its text. The tree is left untouched.
+    """
+    if node.text:
+        yield node.text
+    for child in node:
+        if not isinstance(child.tag, str):
+            # Comments and processing instructions carry no readable text
+            pass
+        elif child.tag == "math":
+            yield clean_math(child)
+        elif child.tag == CROSS_REF_TAG:
+            yield "".join(t.strip() for t in child.itertext())
+        elif child.tag != FLOAT_ANCHOR_TAG:
+            yield from iter_readable_text(child)
+        # Tail text follows the child, even for removed float anchors
+        if child.tail:
+            yield child.tail
+
+def extract_readable_text(para):
+    # Join the stripped text pieces with single spaces
+    cleaned_text = " ".join(t.strip() for t in iter_readable_text(para) if t.strip())
+    # Collapse multiple spaces
+    cleaned_text = re.sub(r'\s+', ' ', cleaned_text)
+    return cleaned_text
+
+# Images are stored as plain JPEG files so the metadata JSONL stays small
+images_dir = 'images'
+
+def process_paper(path):
+    """
+    Extract every figure of one paper that has an image, as one record per figure
+    """
+    tree = etree.parse(path)
+        
+    pii = path.split('/')[-1].split('.')[0]
+    # Get the directory containing the XML file (where images are stored)
+    xml_dir = os.path.dirname(path)
+
+    fig_ref_para_dict = {}
+
+    # find all figures elements
+    figures = figure_xpath(tree)
+
+    # Map each refid to the paragraphs referencing it, in document order
+    refid2paras = defaultdict(list)
+    for para in para_xpath(tree):
+        for refid in cref_xpath(para):
+            paras = refid2paras[refid]
+            if not paras or paras[-1] is not para:
+                paras.append(para)
+    # A paragraph can describe several figures, so extract each one only once
+    para_texts = {}
+    
+    for i in range(len(figures)):
+        figure_id = figures[i].get('id')
+        
+        # Extract caption from figure
+        caption_tag = figures[i].find('.//ce:caption', NS)
+        caption_text = ""
+        if caption_tag is not None:
+            caption_text = extract_readable_text(caption_tag)
+        
+        # Link image into the image store and keep its relative path
+        image_store_path = ''
+        image_found = False
+        link_tag = figures[i].find('.//ce:link', NS)
+        if link_tag is not None and link_tag.get('locator'):
+            locator = link_tag.get('locator')
+            # Construct image path: {pii}-{locator}.jpg
+            image_filename = f"{pii}-{locator}.jpg"
+            image_path = os.path.join(xml_dir, image_filename)
+            if os.path.exists(image_path):
+                image_store_path = os.path.join(images_dir, image_filename)
+                try:
+                    if os.path.exists(image_store_path):
+                        os.remove(image_store_path)
+                    try:
+                        os.link(image_path, image_store_path)
+                    except OSError:
+                        # Hard links fail across filesystems; fall back to a copy
+                        shutil.copyfile(image_path, image_store_path)
+                    image_found = True
+                except Exception as e:
+                    print(f"Warning: Could not store image {image_path}: {e}")
+        
+        # Only add figure to dictionary if image file exists
+        if image_found:
+            # Initialize dictionary entry for this figure
+            if figure_id not in fig_ref_para_dict:
+                fig_ref_para_dict[figure_id] = {
+                    'caption': caption_text,
+                    'descriptions': [],
+                    'image_path': image_store_path
+                }
+            
+            # Find paragraphs that reference this figure
+            for para in refid2paras.get(figure_id, []):
+                if para not in para_texts:
+                    para_texts[para] = extract_readable_text(para)
+                fig_ref_para_dict[figure_id]['descriptions'].append(para_texts[para])
+
+    return [
+        {
+            'pii': pii,
+            'figure_id': figure_id,
+            'caption': data['caption'],
+            'descriptions': data['descriptions'],
+            'image_path': data['image_path']
+        }
+        for figure_id, data in fig_ref_para_dict.items()
+    ]
+